@@ -1,8 +1,8 @@
 """Fake Async Detector CLI for RAP packages."""
 
 from rap_bench.detector import detect_fake_async, DetectorResults
-from rap_bench.libraries import LIBRARY_TESTS
+from rap_bench.libraries import LIBRARY_TESTS, LibraryTest
 
 __version__ = "0.0.1"
-__all__ = ["detect_fake_async", "DetectorResults", "LIBRARY_TESTS"]
+__all__ = ["detect_fake_async", "DetectorResults", "LIBRARY_TESTS", "LibraryTest"]
 
@@ -3,48 +3,98 @@
 import asyncio
 import sys
 import argparse
+import math
+from dataclasses import asdict
 from typing import Optional
 
+try:
+    import uvloop
+except ImportError:  # uvloop is optional and unavailable on Windows
+    uvloop = None
+
 from rap_bench.detector import detect_fake_async
 from rap_bench.libraries import LIBRARY_TESTS
 
 
-def format_results(results) -> str:
-    """Format detector results for display."""
-    status = "✓ PASSED" if results.passed else "✗ FAILED"
-    output = f"""
+_RESULTS_TEMPLATE = """
 Fake Async Detector Results
-{'=' * 60}
+{rule}
 Status: {status}
-{'=' * 60}
+{rule}
 
 Configuration:
-  Total I/O tasks: {results.total_tasks}
-  Blocking tasks: {results.blocking_tasks}
+  Total I/O tasks: {total_tasks}
+  Blocking tasks: {blocking_tasks}
 
 Execution:
-  Successful tasks: {results.successful_tasks}
-  Failed tasks: {results.failed_tasks}
-  Total time: {results.total_time:.3f}s
-  Throughput: {results.throughput:.2f} tasks/sec
+  Successful tasks: {successful_tasks}
+  Failed tasks: {failed_tasks}
+  Total time: {total_time:.3f}s
+  Throughput: {throughput:.2f} tasks/sec
 
 Latency:
-  p50: {results.p50_latency*1000:.2f}ms
-  p95: {results.p95_latency*1000:.2f}ms
+  p50: {p50_latency_ms}
+  p95: {p95_latency_ms}
 
 Event Loop:
-  Stalls detected: {results.event_loop_stalls}
-  Max stall duration: {results.max_stall_duration*1000:.2f}ms
+  Stalls detected: {event_loop_stalls}
+  Max stall duration: {max_stall_duration_ms:.2f}ms
 
 Pass Criteria:
-  ✓ Max stall < 10ms: {'✓' if results.max_stall_duration < 0.01 else '✗'}
-  ✓ Throughput > 100 tasks/sec: {'✓' if results.throughput > 100 else '✗'}
-  ✓ p95 latency < 1s: {'✓' if results.p95_latency < 1.0 else '✗'}
+  ✓ Max stall < 10ms: {stall_ok}
+  ✓ Throughput > 100 tasks/sec: {throughput_ok}
+  ✓ p95 latency < 1s: {latency_ok}
 """
-    return output
 
 
-async def detect(library_name: str, tasks: int = 1000, blocking_tasks: int = 1) -> None:
+def _check_mark(ok: bool) -> str:
+    return '✓' if ok else '✗'
+
+
+def _format_ms(seconds: float) -> str:
+    """Format a duration in milliseconds, showing skipped (NaN) values as n/a."""
+    if math.isnan(seconds):
+        return "n/a"
+    return f"{seconds * 1000:.2f}ms"
+
+
+def format_results(results) -> str:
+    """Format detector results for display."""
+    fields = asdict(results)
+    fields.update(
+        rule='=' * 60,
+        status="✓ PASSED" if results.passed else "✗ FAILED",
+        p50_latency_ms=_format_ms(results.p50_latency),
+        p95_latency_ms=_format_ms(results.p95_latency),
+        max_stall_duration_ms=results.max_stall_duration * 1000,
+        stall_ok=_check_mark(results.max_stall_duration < 0.01),
+        throughput_ok=_check_mark(results.throughput > 100),
+        latency_ok=(
+            "n/a" if math.isnan(results.p95_latency)
+            else _check_mark(results.p95_latency < 1.0)
+        ),
+    )
+    return _RESULTS_TEMPLATE.format_map(fields)
+
+
+def _positive_int(value: str) -> int:
+    """argparse type for options that must be at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid integer value: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+async def detect(
+    library_name: str,
+    tasks: int = 1000,
+    blocking_tasks: int = 1,
+    max_concurrency: Optional[int] = None,
+    compute_full: bool = True,
+) -> None:
     """Run the Fake Async Detector on a library."""
     print(f"Running Fake Async Detector on {library_name}...")
     print(f"Configuration: {tasks} I/O tasks, {blocking_tasks} blocking task(s)")
@@ -56,14 +106,21 @@ async def detect(library_name: str, tasks: int = 1000, blocking_tasks: int = 1)
         print(f"Available libraries: {', '.join(LIBRARY_TESTS.keys())}")
         sys.exit(1)
     
-    test_fn = LIBRARY_TESTS[library_name]
+    library_test = LIBRARY_TESTS[library_name]
     
     try:
+        # Preflight: report a missing library before any I/O tasks launch
+        library_test.check()
+        
         # Run detector
         results = await detect_fake_async(
-            task_fn=test_fn,
+            task_fn=library_test.task,
             total_tasks=tasks,
             blocking_tasks=blocking_tasks,
+            max_concurrency=max_concurrency,
+            setup_fn=library_test.setup,
+            teardown_fn=library_test.teardown,
+            compute_full=compute_full,
         )
         
         # Display results
@@ -103,13 +160,49 @@ def main() -> None:
         default=1,
         help='Number of blocking tasks (default: 1)'
     )
+    detect_parser.add_argument(
+        '--max-concurrency',
+        type=_positive_int,
+        default=None,
+        help='Maximum number of I/O tasks in flight at once (default: unbounded)'
+    )
+    detect_parser.add_argument(
+        '--loop',
+        choices=['asyncio', 'uvloop'],
+        default='uvloop' if uvloop is not None else 'asyncio',
+        help='Event loop implementation (default: uvloop if installed, else asyncio)'
+    )
+    detect_parser.add_argument(
+        '--verdict-only',
+        action='store_true',
+        help='Skip latency percentiles once the stall or throughput criteria fail'
+    )
     
     list_parser = subparsers.add_parser('list', help='List available test libraries')
     
     args = parser.parse_args()
     
     if args.command == 'detect':
-        asyncio.run(detect(args.library, args.tasks, args.blocking_tasks))
+        if args.loop == 'uvloop' and uvloop is None:
+            print("Error: uvloop not installed. Install with: pip install uvloop")
+            sys.exit(1)
+        
+        coro = detect(
+            args.library,
+            args.tasks,
+            args.blocking_tasks,
+            args.max_concurrency,
+            compute_full=not args.verdict_only,
+        )
+        if args.loop != 'uvloop':
+            asyncio.run(coro)
+        elif sys.version_info >= (3, 11):
+            # The event loop policy API is deprecated from Python 3.14
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(coro)
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            asyncio.run(coro)
     elif args.command == 'list':
         print("Available test libraries:")
         for lib_name in LIBRARY_TESTS.keys():
@@ -1,10 +1,18 @@
 """Fake Async Detector implementation."""
 
 import asyncio
+import functools
+import math
+import threading
 import time
-from typing import List, Callable, Awaitable, Dict, Any, Optional, Union
+from array import array
+from typing import Callable, Awaitable, Any, Optional, Union
 from dataclasses import dataclass
 
+# Bound once so timing hot paths skip the time module attribute lookup.
+# Timings are integer nanoseconds until they are reported.
+_perf_counter_ns = time.perf_counter_ns
+
 
 @dataclass
 class DetectorResults:
@@ -22,117 +30,218 @@ class DetectorResults:
     passed: bool
 
 
+# Histogram layout: values below 2**_SUB_BUCKET_BITS get one bucket each;
+# above that every power of two is split into _HALF_SUB_BUCKETS linear
+# buckets, which bounds the relative error at 1 / _HALF_SUB_BUCKETS.
+_SUB_BUCKET_BITS = 8
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_HALF_SUB_BUCKETS = _SUB_BUCKETS >> 1
+_MAX_VALUE_BITS = 48
+_HIST_BUCKETS = _SUB_BUCKETS + (_MAX_VALUE_BITS - _SUB_BUCKET_BITS) * _HALF_SUB_BUCKETS
+
+
+class _LatencyHistogram:
+    """
+    Fixed-size log-linear histogram of integer latencies (HdrHistogram-style).
+
+    Recording is O(1) and memory does not grow with the number of samples.
+    """
+
+    __slots__ = ("_counts", "count")
+
+    def __init__(self) -> None:
+        self._counts = [0] * _HIST_BUCKETS
+        self.count = 0
+
+    def record(self, value: int) -> None:
+        """Record a single non-negative integer value."""
+        if value < _SUB_BUCKETS:
+            index = value if value > 0 else 0
+        else:
+            shift = value.bit_length() - _SUB_BUCKET_BITS
+            index = shift * _HALF_SUB_BUCKETS + (value >> shift)
+            if index >= _HIST_BUCKETS:
+                index = _HIST_BUCKETS - 1
+        self._counts[index] += 1
+        self.count += 1
+
+    def value_at_quantile(self, quantile: float) -> int:
+        """Return the highest value equivalent to the nearest-rank quantile."""
+        if not self.count:
+            return 0
+        rank = min(int(self.count * quantile), self.count - 1)
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen > rank:
+                return _bucket_upper_bound(index)
+        return _bucket_upper_bound(_HIST_BUCKETS - 1)
+
+
+def _bucket_upper_bound(index: int) -> int:
+    """Return the largest value that maps to the given histogram bucket."""
+    if index < _SUB_BUCKETS:
+        return index
+    shift = (index - _SUB_BUCKETS) // _HALF_SUB_BUCKETS + 1
+    top = index - shift * _HALF_SUB_BUCKETS
+    return ((top + 1) << shift) - 1
+
+
 async def detect_fake_async(
-    task_fn: Callable[[], Awaitable[Any]],
+    task_fn: Callable[..., Awaitable[Any]],
     total_tasks: int = 1000,
     blocking_tasks: int = 1,
     blocking_fn: Optional[Callable[[], Awaitable[Any]]] = None,
+    max_concurrency: Optional[int] = None,
+    setup_fn: Optional[Callable[[], Awaitable[Any]]] = None,
+    teardown_fn: Optional[Callable[[Any], Awaitable[Any]]] = None,
+    compute_full: bool = True,
 ) -> DetectorResults:
     """
     Detect fake async implementations by measuring event loop behavior.
     
     Args:
-        task_fn: Async function to test (should accept no args and return awaitable)
+        task_fn: Async function to test (should accept no args and return awaitable,
+            or the setup_fn result if setup_fn is given)
         total_tasks: Number of concurrent I/O tasks to run
         blocking_tasks: Number of blocking tasks to run concurrently
         blocking_fn: Optional blocking task function (default: sleeps for 1 second)
+        max_concurrency: Maximum number of I/O tasks in flight at once
+            (default: all of them)
+        setup_fn: Optional async function run once before the I/O tasks; its
+            result is passed to task_fn and teardown_fn
+        teardown_fn: Optional async function run once after the I/O tasks
+        compute_full: Compute latency percentiles even when the stall or
+            throughput criteria have already failed (otherwise they are NaN)
     
     Returns:
         DetectorResults with metrics and pass/fail status
+    
+    Raises:
+        ValueError: If max_concurrency is less than 1
     """
+    if max_concurrency is not None and max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+    
     if blocking_fn is None:
         # Default blocking task: sleeps for 1 second
         async def default_blocking():
             await asyncio.sleep(1.0)
         blocking_fn = default_blocking
     
-    # Track event loop stalls
-    stall_durations: List[float] = []
-    last_check_time = time.perf_counter()
+    # Prepare shared fixtures once rather than per task
+    fixture = None
+    if setup_fn is not None:
+        fixture = await setup_fn()
+        task_fn = functools.partial(task_fn, fixture)
+    
+    # Track event loop stalls from a sibling thread, so the sampling cadence
+    # is not itself delayed by the loop being measured
+    loop = asyncio.get_running_loop()
     check_interval = 0.001  # Check every 1ms
+    # Record lags longer than half the check interval
+    stall_threshold_ns = int(check_interval * 1e9) // 2
+    stall_durations_ns = array('q', [0]) * 4096  # Preallocated, grows if needed
+    stall_count = 0
+    stop_monitor = threading.Event()
     
-    async def monitor_event_loop():
-        """Monitor event loop for stalls."""
-        nonlocal last_check_time
-        while True:
-            await asyncio.sleep(check_interval)
-            current_time = time.perf_counter()
-            elapsed = current_time - last_check_time
-            if elapsed > check_interval * 1.5:  # Detect stalls > 50% over expected
-                stall_durations.append(elapsed - check_interval)
-            last_check_time = current_time
-    
-    # Start event loop monitor
-    monitor_task = asyncio.create_task(monitor_event_loop())
-    
-    # Start blocking tasks
-    blocking_task_list = []
-    for _ in range(blocking_tasks):
-        blocking_task_list.append(asyncio.create_task(blocking_fn()))
+    def monitor_event_loop(_pc=_perf_counter_ns):
+        """Time how long the loop takes to run a callback posted from this thread."""
+        nonlocal stall_count
+        probe_ran = threading.Event()
+        while not stop_monitor.wait(check_interval):
+            probe_ran.clear()
+            posted_time = _pc()
+            loop.call_soon_threadsafe(probe_ran.set)
+            while not probe_ran.wait(check_interval):
+                if stop_monitor.is_set():
+                    return
+            lag_ns = _pc() - posted_time
+            if lag_ns > stall_threshold_ns:
+                if stall_count < len(stall_durations_ns):
+                    stall_durations_ns[stall_count] = lag_ns
+                else:
+                    stall_durations_ns.append(lag_ns)
+                stall_count += 1
+    
+    monitor_thread = threading.Thread(
+        target=monitor_event_loop, name="rap-bench-monitor", daemon=True
+    )
     
     # Track task latencies
-    task_start_times: Dict[asyncio.Task, float] = {}
-    task_latencies: List[float] = []
-    successful_tasks = 0
-    failed_tasks = 0
-    
-    async def run_single_task(task_id: int):
-        """Run a single I/O task and track its latency."""
-        nonlocal successful_tasks, failed_tasks
-        start_time = time.perf_counter()
-        try:
-            result = await task_fn()
-            end_time = time.perf_counter()
-            latency = end_time - start_time
-            task_latencies.append(latency)
-            successful_tasks += 1
-            return result
-        except Exception as e:
-            failed_tasks += 1
-            end_time = time.perf_counter()
-            latency = end_time - start_time
-            task_latencies.append(latency)
-            # Re-raise to be collected by gather
-            raise
-    
-    # Start all I/O tasks concurrently
-    start_time = time.perf_counter()
-    io_tasks = [asyncio.create_task(run_single_task(i)) for i in range(total_tasks)]
-    
-    # Wait for all tasks to complete
-    task_results = await asyncio.gather(*io_tasks, return_exceptions=True)
-    end_time = time.perf_counter()
-    
-    # Cancel monitor
-    monitor_task.cancel()
+    latency_histogram = _LatencyHistogram()  # latencies in nanoseconds
+    record_latency = latency_histogram.record
+    
+    # Bound the number of I/O tasks in flight: each worker runs one task at a
+    # time, pulling task ids from a shared iterator until it is exhausted
+    worker_count = min(max_concurrency or total_tasks, total_tasks)
+    task_ids = iter(range(total_tasks))
+    
+    async def run_worker(_record=record_latency, _pc=_perf_counter_ns) -> int:
+        """Run I/O tasks, tracking their latency, and return how many succeeded."""
+        succeeded = 0
+        for _ in task_ids:
+            start_time = _pc()
+            try:
+                await task_fn()
+                end_time = _pc()
+                succeeded += 1
+            except Exception:
+                end_time = _pc()
+            _record(end_time - start_time)
+        return succeeded
+    
     try:
-        await monitor_task
-    except asyncio.CancelledError:
-        pass
+        # Start event loop monitor
+        monitor_thread.start()
+        
+        # Start blocking tasks
+        blocking_task_list = []
+        for _ in range(blocking_tasks):
+            blocking_task_list.append(asyncio.create_task(blocking_fn()))
+        
+        # Drive the workers as plain coroutines; only worker_count Tasks are
+        # created rather than one per I/O task
+        start_time = _perf_counter_ns()
+        worker_results = await asyncio.gather(
+            *[run_worker() for _ in range(worker_count)]
+        )
+        end_time = _perf_counter_ns()
+    finally:
+        # Stop monitor
+        stop_monitor.set()
+        if monitor_thread.is_alive():
+            monitor_thread.join()
+        if teardown_fn is not None:
+            await teardown_fn(fixture)
+    successful_tasks = sum(worker_results)
+    failed_tasks = total_tasks - successful_tasks
     
     # Calculate metrics
-    total_time = end_time - start_time
+    total_time = (end_time - start_time) / 1e9
     throughput = successful_tasks / total_time if total_time > 0 else 0
     
-    # Calculate percentiles
-    sorted_latencies = sorted(task_latencies)
-    p50_latency = sorted_latencies[len(sorted_latencies) // 2] if sorted_latencies else 0.0
-    p95_index = int(len(sorted_latencies) * 0.95)
-    p95_latency = sorted_latencies[p95_index] if sorted_latencies and p95_index < len(sorted_latencies) else 0.0
-    
-    max_stall = max(stall_durations) if stall_durations else 0.0
-    
-    # Count exceptions from results
-    exception_count = len([r for r in task_results if isinstance(r, Exception)])
+    max_stall_ns = max(stall_durations_ns[:stall_count]) if stall_count else 0
     
     # Pass criteria:
     # 1. No significant event loop stalls (>10ms)
     # 2. Stable throughput (no collapse under contention)
     # 3. Reasonable latency (p95 < 1 second for simple I/O)
+    stall_ok = max_stall_ns < 10_000_000  # No stalls > 10ms
+    throughput_ok = throughput > 100  # At least 100 tasks/sec
+    
+    # Calculate percentiles, unless the run has already failed and the
+    # caller only needs the verdict
+    if compute_full or (stall_ok and throughput_ok):
+        p50_latency_ns = latency_histogram.value_at_quantile(0.50)
+        p95_latency_ns = latency_histogram.value_at_quantile(0.95)
+    else:
+        p50_latency_ns = p95_latency_ns = math.nan
+    
     passed = (
-        max_stall < 0.01 and  # No stalls > 10ms
-        throughput > 100 and  # At least 100 tasks/sec
-        p95_latency < 1.0 and  # p95 latency < 1 second
+        stall_ok and
+        throughput_ok and
+        p95_latency_ns < 1_000_000_000 and  # p95 latency < 1 second
         successful_tasks > total_tasks * 0.95  # At least 95% success rate
     )
     
@@ -140,13 +249,13 @@ async def detect_fake_async(
         total_tasks=total_tasks,
         blocking_tasks=blocking_tasks,
         successful_tasks=successful_tasks,
-        failed_tasks=exception_count,
+        failed_tasks=failed_tasks,
         total_time=total_time,
         throughput=throughput,
-        p50_latency=p50_latency,
-        p95_latency=p95_latency,
-        event_loop_stalls=len(stall_durations),
-        max_stall_duration=max_stall,
+        p50_latency=p50_latency_ns / 1e9,
+        p95_latency=p95_latency_ns / 1e9,
+        event_loop_stalls=stall_count,
+        max_stall_duration=max_stall_ns / 1e9,
         passed=passed,
     )
 
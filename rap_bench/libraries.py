@@ -3,134 +3,189 @@
 import asyncio
 import tempfile
 import os
-from typing import Callable, Awaitable, Any
+from typing import Callable, Awaitable, Any, NamedTuple
 
+# Optional libraries under test, imported once per process. A missing
+# library is reported by the test's availability check.
+try:
+    import rapfiles
+except ImportError:
+    rapfiles = None
 
-async def test_rapfiles():
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+try:
+    import rapsqlite
+except ImportError:
+    rapsqlite = None
+
+try:
+    import rapcsv
+except ImportError:
+    rapcsv = None
+
+
+class LibraryTest(NamedTuple):
+    """
+    Hooks for benchmarking one library.
+
+    ``setup`` runs once and returns a fixture (usually a file path), ``task``
+    is awaited once per I/O task with that fixture, and ``teardown`` receives
+    the fixture once all tasks have finished. ``check`` raises ImportError
+    if the library is not installed, without touching the filesystem.
+    """
+    setup: Callable[[], Awaitable[Any]]
+    task: Callable[[Any], Awaitable[Any]]
+    teardown: Callable[[Any], Awaitable[Any]]
+    check: Callable[[], None]
+
+
+def _requires(module: Any, name: str) -> Callable[[], None]:
+    """Return an availability check that raises ImportError if module is missing."""
+    def check() -> None:
+        if module is None:
+            raise ImportError(f"{name} not installed. Install with: pip install {name}")
+    return check
+
+
+def _no_requirements() -> None:
+    """Availability check for tests that only need the standard library."""
+
+
+_check_rapfiles = _requires(rapfiles, "rapfiles")
+_check_aiosqlite = _requires(aiosqlite, "aiosqlite")
+_check_rapsqlite = _requires(rapsqlite, "rapsqlite")
+_check_rapcsv = _requires(rapcsv, "rapcsv")
+
+
+def _make_temp_file(suffix: str, contents: str = "") -> str:
+    """Create a temporary file that outlives its handle and return its path."""
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=suffix) as f:
+        f.write(contents)
+        return f.name
+
+
+async def _remove_temp_file(test_file: str):
+    """Remove the file created by a setup hook."""
+    try:
+        os.unlink(test_file)
+    except FileNotFoundError:
+        pass
+
+
+async def setup_rapfiles() -> str:
+    """Create the file read by the rapfiles test."""
+    _check_rapfiles()
+    return _make_temp_file('.txt', "test content")
+
+
+async def test_rapfiles(test_file: str):
     """Test rapfiles library."""
+    # Test async read
+    content = await rapfiles.read_file(test_file)
+    return True
+
+
+async def setup_aiosqlite() -> str:
+    """Create the database queried by the aiosqlite test."""
+    _check_aiosqlite()
+    test_db = _make_temp_file('.db')
     try:
-        import rapfiles
-        
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt') as f:
-            test_file = f.name
-            f.write("test content")
-        
-        try:
-            # Test async read
-            content = await rapfiles.read_file(test_file)
-            # Test async write
-            await rapfiles.write_file(test_file, "new content")
-            return True
-        finally:
-            # Cleanup
-            if os.path.exists(test_file):
-                os.unlink(test_file)
-    except ImportError:
-        raise ImportError("rapfiles not installed. Install with: pip install rapfiles")
-
-
-async def test_aiosqlite():
+        async with aiosqlite.connect(test_db) as db:
+            await db.execute("CREATE TABLE test (id INTEGER)")
+            await db.commit()
+    except BaseException:
+        os.unlink(test_db)
+        raise
+    return test_db
+
+
+async def test_aiosqlite(test_db: str):
     """Test aiosqlite library (for comparison - likely fake async)."""
-    try:
-        import aiosqlite
-        import tempfile
-        import os
-        
-        test_db = tempfile.mktemp(suffix='.db')
-        try:
-            async with aiosqlite.connect(test_db) as db:
-                await db.execute("CREATE TABLE test (id INTEGER)")
-                await db.commit()
-            return True
-        finally:
-            if os.path.exists(test_db):
-                os.unlink(test_db)
-    except ImportError:
-        raise ImportError("aiosqlite not installed. Install with: pip install aiosqlite")
-
-
-async def test_asyncio_files():
+    async with aiosqlite.connect(test_db) as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM test")
+        await cursor.fetchall()
+    return True
+
+
+async def setup_asyncio_files() -> str:
+    """Create the file read by the asyncio file I/O test."""
+    return _make_temp_file('.txt', "test")
+
+
+async def test_asyncio_files(test_file: str):
     """Test standard asyncio file I/O (wraps blocking I/O in threads)."""
-    import tempfile
-    import os
-    
-    test_file = tempfile.mktemp(suffix='.txt')
+    # Use asyncio.to_thread for blocking I/O (this is fake async)
+    def read_file():
+        with open(test_file, 'r') as f:
+            return f.read()
+
+    await asyncio.to_thread(read_file)
+    return True
+
+
+async def setup_rapsqlite() -> str:
+    """Create the database queried by the rapsqlite test."""
+    _check_rapsqlite()
+    # Create temp file in temp directory that exists
+    test_db = _make_temp_file('.db')
     try:
-        # Use asyncio.to_thread for blocking I/O (this is fake async)
-        def write_file():
-            with open(test_file, 'w') as f:
-                f.write("test")
-        
-        def read_file():
-            with open(test_file, 'r') as f:
-                return f.read()
-        
-        await asyncio.to_thread(write_file)
-        await asyncio.to_thread(read_file)
-        return True
-    finally:
-        if os.path.exists(test_file):
-            os.unlink(test_file)
-
-
-async def test_rapsqlite():
+        conn = rapsqlite.Connection(test_db)
+        await conn.execute("CREATE TABLE test (id INTEGER PRIMARY KEY, name TEXT)")
+        await conn.execute("INSERT INTO test (name) VALUES ('test')")
+    except BaseException:
+        os.unlink(test_db)
+        raise
+    return test_db
+
+
+async def test_rapsqlite(test_db: str):
     """Test rapsqlite library."""
+    conn = rapsqlite.Connection(test_db)
+    rows = await conn.fetch_all("SELECT * FROM test")
+    assert len(rows) > 0, "Should have at least one row"
+    return True
+
+
+async def setup_rapcsv() -> str:
+    """Create the CSV file read by the rapcsv test."""
+    _check_rapcsv()
+    test_file = _make_temp_file('.csv')
     try:
-        from rapsqlite import Connection
-        import tempfile
-        import os
-        
-        # Create temp file in temp directory that exists
-        with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
-            test_db = f.name
-        
-        try:
-            conn = Connection(test_db)
-            await conn.execute("CREATE TABLE test (id INTEGER PRIMARY KEY, name TEXT)")
-            await conn.execute("INSERT INTO test (name) VALUES ('test')")
-            rows = await conn.fetch_all("SELECT * FROM test")
-            assert len(rows) > 0, "Should have at least one row"
-            return True
-        finally:
-            if os.path.exists(test_db):
-                os.unlink(test_db)
-    except ImportError:
-        raise ImportError("rapsqlite not installed. Install with: pip install rapsqlite")
-
-
-async def test_rapcsv():
+        writer = rapcsv.Writer(test_file)
+        await writer.write_row(["col1", "col2", "col3"])
+        await writer.write_row(["val1", "val2", "val3"])
+    except BaseException:
+        os.unlink(test_file)
+        raise
+    return test_file
+
+
+async def test_rapcsv(test_file: str):
     """Test rapcsv library."""
-    try:
-        from rapcsv import Reader, Writer
-        import tempfile
-        import os
-        
-        test_file = tempfile.mktemp(suffix='.csv')
-        try:
-            # Test write
-            writer = Writer(test_file)
-            await writer.write_row(["col1", "col2", "col3"])
-            await writer.write_row(["val1", "val2", "val3"])
-            
-            # Test read
-            reader = Reader(test_file)
-            row1 = await reader.read_row()
-            assert len(row1) == 3, "Should have 3 columns"
-            
-            return True
-        finally:
-            if os.path.exists(test_file):
-                os.unlink(test_file)
-    except ImportError:
-        raise ImportError("rapcsv not installed. Install with: pip install rapcsv")
+    reader = rapcsv.Reader(test_file)
+    row1 = await reader.read_row()
+    assert len(row1) == 3, "Should have 3 columns"
+    return True
 
 
 LIBRARY_TESTS = {
-    "rapfiles": test_rapfiles,
-    "rapsqlite": test_rapsqlite,
-    "rapcsv": test_rapcsv,
-    "aiosqlite": test_aiosqlite,
-    "asyncio-files": test_asyncio_files,
+    "rapfiles": LibraryTest(
+        setup_rapfiles, test_rapfiles, _remove_temp_file, _check_rapfiles
+    ),
+    "rapsqlite": LibraryTest(
+        setup_rapsqlite, test_rapsqlite, _remove_temp_file, _check_rapsqlite
+    ),
+    "rapcsv": LibraryTest(
+        setup_rapcsv, test_rapcsv, _remove_temp_file, _check_rapcsv
+    ),
+    "aiosqlite": LibraryTest(
+        setup_aiosqlite, test_aiosqlite, _remove_temp_file, _check_aiosqlite
+    ),
+    "asyncio-files": LibraryTest(
+        setup_asyncio_files, test_asyncio_files, _remove_temp_file, _no_requirements
+    ),
 }
-
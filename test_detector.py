@@ -2,7 +2,9 @@
 
 import asyncio
 from rap_bench.detector import detect_fake_async
-from rap_bench.libraries import test_rapfiles
+from rap_bench.libraries import LIBRARY_TESTS
+
+rapfiles_test = LIBRARY_TESTS["rapfiles"]
 
 
 async def main():
@@ -10,7 +12,11 @@ async def main():
     # Test test_rapfiles directly first
     print("Testing test_rapfiles directly...")
     try:
-        result = await test_rapfiles()
+        test_file = await rapfiles_test.setup()
+        try:
+            result = await rapfiles_test.task(test_file)
+        finally:
+            await rapfiles_test.teardown(test_file)
         print(f"Direct test result: {result}")
     except Exception as e:
         import traceback
@@ -21,9 +27,11 @@ async def main():
     print("\nTesting with detector...")
     try:
         result = await detect_fake_async(
-            test_rapfiles,
+            rapfiles_test.task,
             total_tasks=2,
             blocking_tasks=1,
+            setup_fn=rapfiles_test.setup,
+            teardown_fn=rapfiles_test.teardown,
         )
         print(f"Success: {result.successful_tasks}")
         print(f"Failed: {result.failed_tasks}")
@@ -36,4 +44,3 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-